@@ -4,6 +4,10 @@ import logging
 import datetime
 import hashlib
 import asyncio
+import math
+import sys
+import time
+from collections import Counter
 from pathlib import Path
 
 from docx import Document
@@ -531,6 +535,168 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🤷‍♂️ Ну ну ну, разогнался... Нажми /start")
 
+# ---------- ПРОФИЛИРОВАНИЕ ----------
+PROFILE_MAX_SECONDS = 60           # максимальная длина окна /profile
+PROFILE_INTERVAL = 0.01            # базовый интервал сэмплирования, сек
+PROFILE_MAX_OVERHEAD = 0.02        # доля времени, которую может занимать сэмплер
+PROFILE_MAX_DEPTH = 128            # сколько кадров стека просматриваем за сэмпл
+PROFILE_MAX_FRAMES = 48            # сколько кадров под обработчиком сохраняем
+PROFILE_MAX_STACKS = 2000          # максимум уникальных стеков в отчёте
+PROFILE_MAX_REPORT_BYTES = 512 * 1024
+PROFILE_TOP_N = 10
+
+_profile_running = False
+
+class _StackSampler(threading.Thread):
+    """
+    Сэмплирующий профайлер: раз в PROFILE_INTERVAL снимает стек потока
+    event loop и агрегирует его по обработчику, внутри которого он выполнялся.
+    Интервал растёт, если сам сэмплер занимает больше PROFILE_MAX_OVERHEAD.
+    """
+
+    def __init__(self, target_ident: int, handlers: dict, duration: float):
+        super().__init__(daemon=True)
+        self.target_ident = target_ident
+        self.handlers = handlers
+        self.duration = duration
+        self.stacks = Counter()
+        self.per_handler = Counter()
+        self.total = 0
+        self.dropped = 0
+        self.depth_exceeded = 0
+        self.elapsed = 0.0
+
+    def run(self):
+        started = time.perf_counter()
+        # NaN-сравнения ложны, поэтому жёсткий предел срабатывает при любой duration
+        deadline = started + PROFILE_MAX_SECONDS
+        if self.duration < PROFILE_MAX_SECONDS:
+            deadline = started + self.duration
+        interval = PROFILE_INTERVAL
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self._sample()
+            cost = time.perf_counter() - now
+            interval = max(PROFILE_INTERVAL, cost / PROFILE_MAX_OVERHEAD)
+            time.sleep(min(interval, max(deadline - time.perf_counter(), 0)))
+        self.elapsed = time.perf_counter() - started
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.target_ident)
+        self.total += 1
+        collected, handler = [], None
+        depth = 0
+        while frame is not None and depth < PROFILE_MAX_DEPTH:
+            code = frame.f_code
+            if code in self.handlers:
+                handler = self.handlers[code]
+                break
+            collected.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+            depth += 1
+        truncated = frame is not None and handler is None
+        del frame
+        if handler is None:
+            if truncated:
+                self.depth_exceeded += 1
+            return
+
+        self.per_handler[handler] += 1
+        collected.reverse()
+        if len(collected) > PROFILE_MAX_FRAMES:
+            collected = ["..."] + collected[-PROFILE_MAX_FRAMES:]
+        stack = ";".join([handler] + collected)
+        if stack not in self.stacks and len(self.stacks) >= PROFILE_MAX_STACKS:
+            self.dropped += 1
+            stack = f"{handler};[truncated]"
+        self.stacks[stack] += 1
+
+    def report(self) -> bytes:
+        """Отчёт в формате collapsed stacks (совместим с flamegraph.pl)."""
+        out, size = [], 0
+        for stack, count in self.stacks.most_common():
+            line = f"{stack} {count}\n".encode()
+            if size + len(line) > PROFILE_MAX_REPORT_BYTES:
+                break
+            out.append(line)
+            size += len(line)
+        return b"".join(out)
+
+    def summary(self) -> str:
+        in_handlers = sum(self.per_handler.values())
+        lines = [
+            f"⏱ Профиль за {self.elapsed:.1f} с",
+            f"Сэмплов: {self.total}, в обработчиках: {in_handlers}",
+        ]
+        if self.dropped:
+            lines.append(f"Стеков сверх лимита: {self.dropped}")
+        if self.depth_exceeded:
+            lines.append(f"Сэмплов глубже {PROFILE_MAX_DEPTH} кадров (не учтены): {self.depth_exceeded}")
+        for name, count in self.per_handler.most_common(PROFILE_TOP_N):
+            lines.append(f"{name}: {count} ({count * 100 / in_handlers:.1f}%)")
+        return "\n".join(lines)[:1024]
+
+async def _finish_profile(app: Application, sampler: _StackSampler):
+    global _profile_running
+    try:
+        await asyncio.to_thread(sampler.join)
+        report = sampler.report()
+        if not report:
+            await app.bot.send_message(
+                chat_id=ADMIN_ID,
+                text=sampler.summary() + "\n\n📭 Обработчики не выполнялись."
+            )
+            return
+        await app.bot.send_document(
+            chat_id=ADMIN_ID,
+            document=report,
+            filename=f"profile_{datetime.datetime.utcnow():%Y%m%d_%H%M%S}.txt",
+            caption=sampler.summary()
+        )
+    except Exception as e:
+        logger.exception("Ошибка профилирования: %s", e)
+    finally:
+        _profile_running = False
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _profile_running
+    if update.effective_user.id != ADMIN_ID:
+        return
+    if not context.args:
+        await update.message.reply_text(f"❌ Используй: /profile <секунды> (до {PROFILE_MAX_SECONDS})")
+        return
+    try:
+        seconds = float(context.args[0])
+    except ValueError:
+        seconds = math.nan
+    if not math.isfinite(seconds) or seconds <= 0:
+        await update.message.reply_text("❌ Неверный формат длительности.")
+        return
+    if _profile_running:
+        await update.message.reply_text("⏳ Профилирование уже идёт.")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+
+    _profile_running = True
+    sampler = _StackSampler(threading.get_ident(), PROFILED_HANDLERS, seconds)
+    sampler.start()
+    context.application.create_task(_finish_profile(context.application, sampler))
+    await update.message.reply_text(f"🔬 Профилирование запущено на {seconds:g} с.")
+
+PROFILED_HANDLERS = {
+    f.__code__: f.__name__
+    for f in (
+        add_start, add_key, add_desc, edit_start, edit_key, edit_desc,
+        del_start, del_key, cancel, feedback_start, feedback_receive,
+        broadcast_start, broadcast_send, adduser, addusers, start,
+        users_command, approve_callback, toggle_user_status,
+        history_command, stats_command, list_entries, list_button,
+        handle_message, unknown, profile_command
+    )
+}
+
 # ---------- HANDLERS ----------
 conv_add = ConversationHandler(
     entry_points=[CommandHandler("add", add_start, filters=filters.User(user_id=ADMIN_ID))],
@@ -591,6 +757,7 @@ async def post_init(app: Application):
             BotCommand("stats", "Статистика"),
             BotCommand("users", "Список пользователей"),
             BotCommand("broadcast", "Рассылка всем (админ)"),
+            BotCommand("profile", "Профилирование обработчиков"),
             BotCommand("cancel", "Отменить")
         ])
     await app.bot.set_my_commands(commands)
@@ -610,6 +777,7 @@ def main():
     application.add_handler(CommandHandler("history", history_command, filters=filters.User(user_id=ADMIN_ID)))
     application.add_handler(CommandHandler("stats", stats_command, filters=filters.User(user_id=ADMIN_ID)))
     application.add_handler(CommandHandler("list", list_entries, filters=filters.User(user_id=ADMIN_ID)))
+    application.add_handler(CommandHandler("profile", profile_command, filters=filters.User(user_id=ADMIN_ID)))
     application.add_handler(conv_add)
     application.add_handler(conv_edit)
     application.add_handler(conv_del)